@@ -13,6 +13,12 @@ with open('HISTORY.rst') as history_file:
 
 requirements = ['Flask==0.12.2', 'requests==2.18.4']
 
+# optional speedups, picked up automatically when installed
+extras_requirements = {
+    'async': ['aiohttp>=3.3'],
+    'fast_json': ['orjson'],
+}
+
 setup_requirements = ['pytest-runner']
 
 test_requirements = ['pytest']
@@ -33,6 +39,7 @@ setup(
     description=("Website Monitor is a program used for monitoring web sites "
                  "and reporting their availability."),
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for content requirement matching and `db_utils` storage helpers."""
+
+import datetime
+import http.server
+import logging
+import re
+import socketserver
+import sqlite3
+import threading
+
+import pytest
+
+from web_app.app import app
+from website_monitor import db_utils, website_monitor
+from website_monitor.website_monitor import (
+    INVALID_CONTENT_REQUIREMENTS, AsyncResponse, Monitor,
+    WebMonitorConfigObject
+)
+from website_monitor.wm_exceptions import RequirementsNotFulfilled
+
+
+@pytest.fixture
+def db(tmpdir, monkeypatch):
+    monkeypatch.setattr(db_utils, 'DB_NAME', str(tmpdir / 'test.db'))
+    monkeypatch.setattr(db_utils, '_CONN', None)
+    monkeypatch.setattr(db_utils, '_configs_snapshot', None)
+    monkeypatch.setattr(db_utils, '_configs_cache', None)
+    yield db_utils
+    db_utils._close_connection()
+
+
+class CheckedSiteHandler(http.server.BaseHTTPRequestHandler):
+    """Serves pages whose HEAD and GET responses can differ."""
+
+    # path: (HEAD status, GET status)
+    statuses = {
+        '/': (200, 200),
+        '/head-403': (403, 200),
+        '/head-405': (405, 200),
+        '/head-501': (501, 200),
+        '/missing': (404, 404),
+        '/broken': (500, 500),
+    }
+    body = b'<html>Hello Yurts</html>'
+
+    def respond(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.respond(self.statuses[self.path][0])
+
+    def do_GET(self):
+        self.respond(self.statuses[self.path][1], self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                          http.server.HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture(scope='module')
+def server_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CheckedSiteHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def monitor():
+    return object.__new__(Monitor)
+
+
+def make_config_store(websites):
+    config_store = object.__new__(WebMonitorConfigObject)
+    config_store.extract_websites(websites)
+    return config_store
+
+
+def make_response(content):
+    return AsyncResponse(200, content, datetime.timedelta(seconds=1))
+
+
+class TestContentRequirements(object):
+    def test_plain_ascii_text_is_kept_as_lowercased_bytes(self):
+        matcher = WebMonitorConfigObject.compile_content_requirements(
+            'Python Software Engineer')
+        assert matcher == b'python software engineer'
+
+    def test_text_with_regex_characters_is_compiled_case_insensitive(self):
+        matcher = WebMonitorConfigObject.compile_content_requirements(
+            'goo.le')
+        assert isinstance(matcher, type(re.compile('')))
+        assert matcher.flags & re.IGNORECASE
+
+    def test_non_ascii_text_is_compiled_as_regex(self):
+        matcher = WebMonitorConfigObject.compile_content_requirements(
+            'zürich')
+        assert not isinstance(matcher, bytes)
+
+    def test_empty_requirements_are_none(self):
+        assert WebMonitorConfigObject.compile_content_requirements('') is None
+        assert WebMonitorConfigObject.compile_content_requirements(
+            None) is None
+
+    def test_literal_requirements_match_bytes_case_insensitively(self):
+        response = make_response(b'<html>Google SEARCH</html>')
+        matcher = WebMonitorConfigObject.compile_content_requirements(
+            'Search')
+        assert Monitor.check_requirements(response, matcher) is True
+        assert Monitor.check_requirements(response, 'google search') is True
+
+    def test_regex_requirements_match_decoded_content(self):
+        response = make_response('<html>Zürich</html>'.encode('utf-8'))
+        assert Monitor.check_requirements(response, 'ZÜRICH') is True
+        assert Monitor.check_requirements(response, 'z.rich') is True
+
+    def test_missing_literal_requirements_should_raise(self):
+        response = make_response(b'<html>Google</html>')
+        with pytest.raises(RequirementsNotFulfilled):
+            Monitor.check_requirements(response, 'yurts')
+
+    def test_invalid_regex_returns_sentinel_instead_of_raising(self):
+        matcher = WebMonitorConfigObject.compile_content_requirements(
+            'foo(bar')
+        assert matcher is INVALID_CONTENT_REQUIREMENTS
+
+    def test_invalid_requirements_should_raise(self):
+        response = make_response(b'<html>foo(bar</html>')
+        with pytest.raises(RequirementsNotFulfilled):
+            Monitor.check_requirements(response, INVALID_CONTENT_REQUIREMENTS)
+
+
+class TestCreateTables(object):
+    def test_create_tables_on_existing_database_logs_no_errors(
+            self, db, caplog):
+        db.create_tables()
+        db.create_tables()
+
+        assert not [r for r in caplog.records if r.levelno >= logging.ERROR]
+
+
+class TestRequestTimeMigration(object):
+    def test_create_tables_rewrites_legacy_request_times_to_iso(self, db):
+        conn = sqlite3.connect(db.DB_NAME)
+        conn.execute(
+            '''
+            CREATE TABLE website_checks (
+                id INTEGER, webname TEXT, url TEXT, request_time REAL,
+                status INTEGER, response_time REAL, requirements INTEGER,
+                error TEXT, PRIMARY KEY(id))
+            ''')
+        conn.execute(
+            '''INSERT INTO website_checks (webname, request_time)
+            VALUES ('old', '05-03-2024 10:11:12')''')
+        conn.commit()
+        conn.close()
+
+        db.create_tables()
+        db.insert_webcheck_records_bulk([
+            ('new', 'u', datetime.datetime(2025, 1, 2, 3, 4, 5), 200, 0.1, 1,
+             None)])
+        # running it again must leave ISO request times untouched
+        db.create_tables()
+
+        records = list(db.get_all_webcheck_records())
+        assert [(r['webname'], r['request_time']) for r in records] == [
+            ('new', '2025-01-02 03:04:05'), ('old', '2024-03-05 10:11:12')]
+
+    def test_request_time_migration_runs_only_once(self, db):
+        db.create_tables()
+        conn, cur = db.get_connection()
+        conn.execute(
+            '''INSERT INTO website_checks (webname, request_time)
+            VALUES ('late', '05-03-2024 10:11:12')''')
+        conn.commit()
+
+        db.create_tables()
+
+        assert conn.execute('''PRAGMA user_version''').fetchone()[0] == \
+            db.ISO_REQUEST_TIME_VERSION
+        assert conn.execute(
+            '''SELECT request_time FROM website_checks''').fetchone()[0] == \
+            '05-03-2024 10:11:12'
+
+
+
+class TestWebcheckConfigs(object):
+    def test_insert_webcheck_config_classifies_new_modified_and_redundant(
+            self, db):
+        db.create_tables()
+
+        assert db.insert_webcheck_config('google', 'u1', 'search') == \
+            db.new_record
+        assert db.insert_webcheck_config('google', 'u1', 'search') == \
+            db.redundant
+        assert db.insert_webcheck_config('google', 'u2', 'search') == \
+            db.modification
+        assert db.insert_webcheck_config('google', 'u2', None) == \
+            db.modification
+        assert db.insert_webcheck_config('google', 'u2', None) == \
+            db.redundant
+        assert [r[1:] for r in db.get_all_webcheck_configs()] == [
+            ('google', 'u2', None)]
+
+    def test_is_in_database_uses_configs_stored_by_earlier_runs(
+            self, db, monkeypatch):
+        db.create_tables()
+        db.insert_webcheck_config('google', 'u1', 'search')
+        # forget the in-memory snapshot, as a fresh process would
+        monkeypatch.setattr(db_utils, '_configs_snapshot', None)
+
+        assert db.is_in_database('google', 'u1', 'search') == db.redundant
+        assert db.is_in_database('google', 'u1', 'other') == db.modification
+        assert db.is_in_database('bing', 'u1', None) == db.new_record
+
+
+class TestRecordsPage(object):
+    @pytest.fixture
+    def records(self, db, monkeypatch):
+        monkeypatch.setattr(db_utils, 'RECORDS_PAGE_SIZE', 2)
+        db.create_tables()
+        db.insert_webcheck_records_bulk([
+            ('site{}'.format(i), 'u', datetime.datetime(2020, 1, i + 1), 200,
+             0.1, 1, None) for i in range(5)])
+        return db
+
+    @staticmethod
+    def get_page(url):
+        page = app.test_client().get(url).get_data(as_text=True)
+        rows = re.findall(r'<th scope="row">(\d+)</th>\s*<td>(\w+)</td>', page)
+        links = re.findall(r'class="page-link"[^>]*>(\w+)<', page)
+        return rows, links
+
+    def test_first_page_shows_newest_records_and_older_link(self, records):
+        rows, links = self.get_page('/')
+        assert rows == [('1', 'site4'), ('2', 'site3')]
+        assert links == ['Older']
+
+    def test_middle_page_continues_numbering_and_links_both_ways(
+            self, records):
+        rows, links = self.get_page('/?page=2')
+        assert rows == [('3', 'site2'), ('4', 'site1')]
+        assert links == ['Newer', 'Older']
+
+    def test_last_page_has_no_older_link(self, records):
+        rows, links = self.get_page('/?page=3')
+        assert rows == [('5', 'site0')]
+        assert links == ['Newer']
+
+    def test_reading_a_page_does_not_pin_an_old_snapshot(self, records):
+        assert records.get_all_webcheck_records(1)[0]['webname'] == 'site4'
+
+        conn = sqlite3.connect(records.DB_NAME)
+        conn.execute(
+            '''INSERT INTO website_checks (webname, request_time)
+            VALUES ('newest', '2030-01-01 00:00:00')''')
+        conn.commit()
+        conn.close()
+
+        assert records.get_all_webcheck_records(1)[0]['webname'] == 'newest'
+
+
+class TestHeadRequests(object):
+    @pytest.mark.parametrize('path', ['/head-403', '/head-405', '/head-501'])
+    def test_failing_head_falls_back_to_get(self, monitor, server_url, path):
+        record = monitor._perform_checks(server_url + path, None, 'site')
+        assert record[3] == 200
+
+    def test_successful_head_is_used_without_body(self, server_url):
+        response = Monitor.make_request(server_url + '/', need_body=False)
+        assert response.request.method == 'HEAD'
+        assert response.content == b''
+
+
+class TestRoundOfChecks(object):
+    @pytest.fixture
+    def threaded_monitor(self, db, monitor, monkeypatch):
+        monkeypatch.setattr(website_monitor, 'aiohttp', None)
+        db.create_tables()
+        return monitor
+
+    @pytest.mark.parametrize('path, status', [('/missing', 404),
+                                              ('/broken', 500)])
+    def test_error_statuses_are_recorded(self, monitor, server_url, path,
+                                         status):
+        record = monitor._perform_checks(server_url + path, None, 'site')
+        assert record[3] == status
+        assert record[6] is None
+
+    def test_unparsable_url_becomes_error_record(self, monitor):
+        record = monitor._perform_checks('http://a..b/', None, 'site')
+        assert record[:2] == ('site', 'http://a..b/')
+        assert record[3] is None
+        assert record[6]
+
+    def test_bad_website_does_not_discard_the_round(
+            self, db, threaded_monitor, server_url):
+        threaded_monitor.config_store = make_config_store({
+            'good': {'url': server_url + '/', 'content': 'yurts'},
+            'bad': {'url': 'http://a..b/'},
+        })
+
+        threaded_monitor._start_checks()
+
+        records = {r['webname']: r for r in db.get_all_webcheck_records()}
+        assert records['good']['status'] == 200
+        assert records['good']['requirements'] == 1
+        assert records['bad']['status'] is None
+        assert records['bad']['error']
+
+
+class StopWatching(BaseException):
+    """Raised from a patched time.sleep to end the watch loop."""
+
+
+class TestWatchLoop(object):
+    def test_failed_round_does_not_stop_watching(self, monitor, monkeypatch):
+        rounds, sleeps = [], []
+
+        def start_checks():
+            rounds.append(len(rounds))
+            if len(rounds) == 1:
+                raise RuntimeError('round failed')
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 2:
+                raise StopWatching
+
+        monitor.config_store = make_config_store({})
+        monitor.config_store.check_period = 60
+        monitor.next_call = 0
+        monkeypatch.setattr(monitor, 'hot_load_config', lambda: None)
+        monkeypatch.setattr(monitor, '_start_checks', start_checks)
+        monkeypatch.setattr(website_monitor.time, 'sleep', sleep)
+
+        with pytest.raises(StopWatching):
+            monitor._watch_loop()
+
+        assert rounds == [0, 1]
+        assert monitor.next_call == 120
+
+
+class TestAsyncRoundOfChecks(object):
+    @pytest.fixture
+    def async_monitor(self, db, monitor):
+        pytest.importorskip('aiohttp')
+        db.create_tables()
+        yield monitor
+        monitor.close()
+
+    def test_async_round_records_every_website(self, db, async_monitor,
+                                               server_url):
+        async_monitor.config_store = make_config_store({
+            'good': {'url': server_url + '/', 'content': 'yurts'},
+            'unmet': {'url': server_url + '/', 'content': 'nothere'},
+            'no_head': {'url': server_url + '/head-405'},
+            'head_forbidden': {'url': server_url + '/head-403'},
+            'missing': {'url': server_url + '/missing'},
+            'bad': {'url': 'http://a..b/'},
+        })
+
+        async_monitor._start_checks()
+
+        records = {r['webname']: r for r in db.get_all_webcheck_records()}
+        assert {name: (r['status'], r['requirements'])
+                for name, r in records.items() if name != 'bad'} == {
+            'good': (200, 1),
+            'unmet': (200, 0),
+            'no_head': (200, 1),
+            'head_forbidden': (200, 1),
+            'missing': (404, 1),
+        }
+        assert records['bad']['status'] is None
+        assert records['bad']['error']
+
+    def test_session_and_loop_are_reused_between_rounds(self, async_monitor,
+                                                        server_url):
+        async_monitor.config_store = make_config_store({
+            'good': {'url': server_url + '/'}})
+
+        async_monitor._start_checks()
+        loop, session = async_monitor._loop, async_monitor._session
+        async_monitor._start_checks()
+
+        assert async_monitor._loop is loop
+        assert async_monitor._session is session
+        assert not session.closed
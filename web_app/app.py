@@ -1,20 +1,39 @@
 # -*- coding: utf-8 -*-
 
 """Flask website application module."""
-from flask import Flask, render_template
+from flask import (
+    Flask, Response, render_template, request, stream_with_context
+)
 from website_monitor import db_utils
-from datetime import datetime
 
 app = Flask(__name__)
 
 
+def stream_template(template_name, **context):
+    """
+    Render template as a stream of chunks instead of a single string.
+
+    :param template_name: Name of the template to render
+    :param context: Variables available in the template
+    :return: Generator yielding rendered template chunks
+    """
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    return template.stream(context)
+
+
 @app.route('/', methods=['GET'])
 def index():
-    records = db_utils.get_all_webcheck_records()
-    records = sorted(records, key=lambda x: datetime.strptime(
-        x[3], "%d-%m-%Y %H:%M:%S"), reverse=True)
-
-    return render_template('index.html', records=records)
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = db_utils.RECORDS_PAGE_SIZE
+    offset = (page - 1) * page_size
+    # fetch one extra record to find out whether there is a next page
+    records = db_utils.get_all_webcheck_records(page_size + 1, offset)
+    has_next = len(records) > page_size
+
+    return Response(stream_with_context(stream_template(
+        'index.html', records=records[:page_size], page=page, offset=offset,
+        has_next=has_next)))
 
 @app.route('/edit/', methods=['GET'])
 def edit_db():
@@ -2,31 +2,86 @@
 
 """Database utils module."""
 
+import atexit
+import logging as log
 import os
 import sqlite3
+import threading
+import time
 
 DB_NAME = 'website_monitor.db'
 DB_TABLE_NAME = 'website_checks'
+RECORDS_PAGE_SIZE = 500
+# PRAGMA user_version from which request times are stored in ISO format
+ISO_REQUEST_TIME_VERSION = 1
+# ISO-like format, so lexicographic order of stored values is chronological
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# single connection shared by the whole process, opened lazily on first use
+_CONN = None
+# serializes access to the shared connection between monitor threads
+_LOCK = threading.RLock()
+
+# website configs rarely change, so they are cached in-process; the TTL
+# bounds staleness when another process (e.g. the monitor) writes them
+CONFIGS_CACHE_TTL = 60
+_configs_cache = None
+_configs_cache_time = 0
+_configs_cache_lock = threading.Lock()
+# {webname: (url, content)} mirror of website_configs, loaded on first use
+_configs_snapshot = None
+
+# one constant SQL text, so sqlite3 reuses a single cached prepared statement
+INSERT_WEBCHECK_SQL = '''
+    INSERT INTO website_checks (
+        webname, url, request_time, status, response_time,
+        requirements,error
+    ) VALUES(?,?,?,?,?,?,?)
+    '''
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-64000',
+)
+
+
+def _close_connection():
+    """
+    Helper function used to close the shared connection at interpreter exit.
+
+    :return: None
+    """
+    global _CONN
+    if _CONN is not None:
+        _CONN.close()
+        _CONN = None
 
 
 def get_connection():
     """
-    Helper function used to initiate database connection.
+    Helper function used to get the shared database connection.
+    The connection is opened (and tuned) only once per process.
 
     :return: Tuple of two items - sqlite3.Connection class instance
         and sqlite3.Cursor class instance
     """
-    conn, cur = None, None
+    global _CONN
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), DB_NAME)
 
-    try:
-        conn = sqlite3.connect(path)
-    except Exception as e:
-        print("Error while making connection with DB: {}".format(e))
-
-    if conn is not None:
-        cur = conn.cursor()
-    return (conn, cur)
+    with _LOCK:
+        if _CONN is None:
+            try:
+                conn = sqlite3.connect(path, check_same_thread=False)
+                for pragma in PRAGMAS:
+                    conn.execute(pragma)
+            except Exception as e:
+                log.error("Error while making connection with DB: %s", e)
+                return (None, None)
+            _CONN = conn
+            atexit.register(_close_connection)
+        return (_CONN, _CONN.cursor())
 
 
 def create_tables():
@@ -36,177 +91,253 @@ def create_tables():
     :return: None
     """
     conn, cur = get_connection()
-    try:
-        cur.execute(
-            '''
-            CREATE TABLE website_checks (
-                id	INTEGER,
-                webname	TEXT,
-                url	TEXT,
-                request_time	REAL,
-                status	INTEGER,
-                response_time	REAL,
-                requirements	INTEGER,
-                error	TEXT,
-                PRIMARY KEY(id))
-            '''
-        )
-        conn.commit()
-    except Exception as e:
-        print("Error while creating table: {}".format(e))
-
-    try:
-        cur.execute(
-            '''
-            CREATE TABLE website_configs (
-                id	INTEGER,
-                webname	TEXT,
-                url	TEXT,
-                content	TEXT,
-                PRIMARY KEY(id))
-            '''
-        )
-        conn.commit()
-    except Exception as e:
-        print("Error while creating table: {}".format(e))
-
-    finally:
-        conn.close()
-
-
-def insert_webcheck_record(webname, url, request_time=None, status=None,
-                  response_time=None, requirements=None, error=None):
-    """
-    Helper function used to create records in the database table.
+    with _LOCK:
+        try:
+            cur.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS website_checks (
+                    id	INTEGER,
+                    webname	TEXT,
+                    url	TEXT,
+                    request_time	REAL,
+                    status	INTEGER,
+                    response_time	REAL,
+                    requirements	INTEGER,
+                    error	TEXT,
+                    PRIMARY KEY(id))
+                '''
+            )
+            conn.commit()
+        except Exception as e:
+            log.error("Error while creating table: %s", e)
 
-    :param webname: Alias name of the website
-    :param url: Website URL
-    :param request_time: Time at which request was made
-    :param status: Status of HTTP response to specific website
-    :param response_time: Time to complete whole request
-    :param requirements: Content requirements for specific website
-    :param error: Error messages for specific website
+        try:
+            cur.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS website_configs (
+                    id	INTEGER,
+                    webname	TEXT,
+                    url	TEXT,
+                    content	TEXT,
+                    PRIMARY KEY(id))
+                '''
+            )
+            conn.commit()
+        except Exception as e:
+            log.error("Error while creating table: %s", e)
+
+        try:
+            cur.execute('''PRAGMA user_version''')
+            if cur.fetchone()[0] < ISO_REQUEST_TIME_VERSION:
+                # one-time rewrite of request times stored in the legacy
+                # dd-mm-YYYY format
+                cur.execute(
+                    '''
+                    UPDATE website_checks
+                    SET request_time = substr(request_time, 7, 4) || '-' ||
+                        substr(request_time, 4, 2) || '-' ||
+                        substr(request_time, 1, 2) || substr(request_time, 11)
+                    WHERE request_time LIKE '__-__-____ %'
+                    '''
+                )
+                cur.execute('PRAGMA user_version = {}'.format(
+                    ISO_REQUEST_TIME_VERSION))
+                conn.commit()
+        except Exception as e:
+            log.error("Error while migrating request times: %s", e)
+
+        try:
+            cur.execute(
+                '''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_configs_webname
+                ON website_configs(webname)
+                '''
+            )
+            conn.commit()
+        except Exception as e:
+            log.error("Error while creating index: %s", e)
+
+        try:
+            cur.execute(
+                '''
+                CREATE INDEX IF NOT EXISTS idx_checks_time
+                ON website_checks(request_time DESC)
+                '''
+            )
+            conn.commit()
+        except Exception as e:
+            log.error("Error while creating index: %s", e)
+
+
+def insert_webcheck_records_bulk(records):
+    """
+    Helper function used to create many records in the database table
+    within a single transaction.
+
+    :param records: Iterable of tuples in the form of (webname, url,
+        request_time, status, response_time, requirements, error)
     :return: None
     """
     conn, cur = get_connection()
-    request_time = request_time.strftime("%d-%m-%Y %H:%M:%S")
-    try:
-        cur.execute(
-            '''
-            INSERT INTO website_checks (
-                webname, url, request_time, status, response_time,
-                requirements,error
-            ) VALUES(?,?,?,?,?,?,?)
-            ''', (webname, url, request_time, status, response_time,
-                  requirements, error))
-        conn.commit()
-    except Exception as e:
-        print("Error while making INSERT: {}".format(e))
-    finally:
-        conn.close()
-
-
-# This is likely very inefficient
+    rows = [(webname, url, request_time.strftime(TIME_FORMAT),
+             status, response_time, requirements, error)
+            for webname, url, request_time, status, response_time,
+            requirements, error in records]
+    if not rows:
+        return
+    with _LOCK:
+        try:
+            with conn:
+                cur.executemany(INSERT_WEBCHECK_SQL, rows)
+        except Exception as e:
+            log.error("Error while making bulk INSERT: %s", e)
+
+
 new_record = 'new_record'
 modification = 'modification'
 redundant = 'redundant'
-def is_in_database(webname, url, content):
+def _get_configs_snapshot():
+    """
+    Helper function used to load website configs into memory once.
+
+    :return: Dict mapping webname to (url, content) tuple
+    """
+    global _configs_snapshot
     conn, cur = get_connection()
-    records = []
-    try:
-        cur.execute('''SELECT * FROM website_configs''')
-        records = cur.fetchall()
-        for record in records:
-            if len(record) < 1:
-                continue
-            if webname == record[1]:
-                if len(record) < 3 or record[2] != url or record[3] != content:
-                    return modification
-                return redundant
-    except Exception as e:
-        print("Error while getting all records: {}".format(e))
-    finally:
-        conn.close()
-    return new_record
+    with _LOCK:
+        if _configs_snapshot is None:
+            try:
+                cur.execute(
+                    '''SELECT webname, url, content FROM website_configs''')
+                _configs_snapshot = {
+                    webname: (url, content)
+                    for webname, url, content in cur.fetchall()}
+            except Exception as e:
+                log.error("Error while getting all records: %s", e)
+                return {}
+        return _configs_snapshot
+
+
+def is_in_database(webname, url, content):
+    """
+    Helper function used to classify a website config against the database.
+    The in-memory snapshot of website_configs is used, so no query is made.
+
+    :param webname: Alias name of the website
+    :param url: Website URL
+    :param content: Content requirements for specific website
+    :return: One of new_record, modification or redundant
+    """
+    known_config = _get_configs_snapshot().get(webname)
+    if known_config is None:
+        return new_record
+    if known_config == (url, content):
+        return redundant
+    return modification
 
 
 def insert_webcheck_config(webname, url, content=None):
     """
-    Helper function used to create records in the database table.
+    Helper function used to create or update website config records
+    in the database table. Unchanged configs are detected in memory
+    and do not touch the database.
 
     :param webname: Alias name of the website
     :param url: Website URL
-    :param requirements: Content requirements for specific website
+    :param content: Content requirements for specific website
+    :return: One of new_record, modification or redundant
     """
     conn, cur = get_connection()
-    candidate_rec = is_in_database(webname, url, content)
-    if candidate_rec == redundant:
-        conn.close()
-        return
+    with _LOCK:
+        candidate_rec = is_in_database(webname, url, content)
+        if candidate_rec == redundant:
+            return redundant
 
-    if candidate_rec == new_record:
         try:
             cur.execute(
                 '''
                 INSERT INTO website_configs (
                     webname, url, content
                 ) VALUES(?,?,?)
+                ON CONFLICT(webname) DO UPDATE SET
+                    url = excluded.url,
+                    content = excluded.content
+                WHERE url IS NOT excluded.url
+                    OR content IS NOT excluded.content
                 ''', (webname, url, content))
             conn.commit()
         except Exception as e:
-            print("Error while making INSERT: {}".format(e))
-        finally:
-            conn.close()
-            return
+            log.error("Error while making UPSERT: %s", e)
+            return candidate_rec
+        _get_configs_snapshot()[webname] = (url, content)
+    _invalidate_configs_cache()
+    return candidate_rec
 
-    elif candidate_rec == modification:
-        try:
-            sql = ''' UPDATE website_configs
-                SET url = ?,
-                    content = ?
-                WHERE webname = ?
-                '''
-            cur.execute(sql, (url, content, webname) )
-            conn.commit()
-        except Exception as e:
-            print("Error while making UPDATE: {}".format(e))
-        finally:
-            conn.close()
-            print('done\n')
-            return
 
-def get_all_webcheck_records():
+def _invalidate_configs_cache():
+    """
+    Helper function used to drop cached website configs after a write.
+
+    :return: None
+    """
+    global _configs_cache
+    with _configs_cache_lock:
+        _configs_cache = None
+
+
+def get_all_webcheck_configs():
     """
     Helper function used to fetch all the records from database table.
+    Results are cached until the next config write or CONFIGS_CACHE_TTL
+    seconds pass.
 
-    :return: List of tuples representing status check records.
+    :return: List of tuples representing website config records.
     """
+    global _configs_cache, _configs_cache_time
+    with _configs_cache_lock:
+        if (_configs_cache is not None and
+                time.time() - _configs_cache_time < CONFIGS_CACHE_TTL):
+            return _configs_cache
+
     conn, cur = get_connection()
-    records = []
-    try:
-        cur.execute('''SELECT * FROM website_checks''')
-        records = cur.fetchall()
-    except Exception as e:
-        print("Error while getting all records: {}".format(e))
-    finally:
-        conn.close()
+    with _LOCK:
+        try:
+            cur.execute('''SELECT * FROM website_configs''')
+            records = cur.fetchall()
+        except Exception as e:
+            log.error("Error while getting all records: %s", e)
+            return []
 
+    with _configs_cache_lock:
+        _configs_cache = records
+        _configs_cache_time = time.time()
     return records
 
-def get_all_webcheck_configs():
+def get_all_webcheck_records(limit=RECORDS_PAGE_SIZE, offset=0):
     """
-    Helper function used to fetch all the records from database table.
+    Helper function used to fetch a page of records from database table,
+    newest first. The page is fetched eagerly, so no statement is left open
+    on the shared connection while the records are being rendered.
 
-    :return: List of tuples representing status check records.
+    :param limit: Maximum number of records to fetch
+    :param offset: Number of newest records to skip
+    :return: List of sqlite3.Row objects representing status check records.
     """
     conn, cur = get_connection()
+    cur.row_factory = sqlite3.Row
     records = []
-    try:
-        cur.execute('''SELECT * FROM website_configs''')
-        records = cur.fetchall()
-    except Exception as e:
-        print("Error while getting all records: {}".format(e))
-    finally:
-        conn.close()
+    with _LOCK:
+        try:
+            cur.execute(
+                '''
+                SELECT id, webname, url, request_time, status, response_time,
+                    requirements, error
+                FROM website_checks
+                ORDER BY request_time DESC
+                LIMIT ? OFFSET ?
+                ''', (limit, offset))
+            records = cur.fetchall()
+        except Exception as e:
+            log.error("Error while getting all records: %s", e)
 
     return records
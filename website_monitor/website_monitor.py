@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 
 """Main module."""
-import copy
+import asyncio
+import collections
 import datetime
 import getopt
 import json
@@ -11,8 +12,20 @@ import re as reg_ex
 import sys
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from website_monitor import db_utils
 from .wm_exceptions import (
@@ -24,10 +37,36 @@ WORK_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_DIR = os.path.join(WORK_DIR, 'logs')
 LOG_FILE_PATH = os.path.join(LOG_DIR, 'logfile.log')
 
+os.makedirs(LOG_DIR, exist_ok=True)
 log.basicConfig(filename=LOG_FILE_PATH, format='%(message)s', level=log.INFO)
 
 
 DEFAULT_CHECK_PERIOD = 3600 
+MAX_WORKERS = 32
+REQUEST_TIMEOUT = 10
+ASYNC_CONNECTION_LIMIT = 64
+# HEAD responses from this status up are retried with GET, since servers
+# without HEAD support answer 405, 501 or even 403/404 to it
+HEAD_FALLBACK_MIN_STATUS = 400
+# used for formatting first and last message of round of checks
+_TIME_FORMAT = '%d/%m/%Y %H:%M:%S'
+_ASTERIX = '*' * 10
+# content requirements without these characters are matched as plain text
+REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
+# marks content requirements that could not be compiled; such websites
+# always fail their requirements check
+INVALID_CONTENT_REQUIREMENTS = object()
+
+# shared session keeps connections alive between rounds of checks
+SESSION = requests.Session()
+SESSION.mount('http://', HTTPAdapter(pool_connections=MAX_WORKERS,
+                                     pool_maxsize=MAX_WORKERS))
+SESSION.mount('https://', HTTPAdapter(pool_connections=MAX_WORKERS,
+                                      pool_maxsize=MAX_WORKERS))
+# minimal stand-in for requests.Response used by the aiohttp based checks
+AsyncResponse = collections.namedtuple(
+    'AsyncResponse', ['status_code', 'content', 'elapsed'])
+
 
 class WebMonitorConfigObject(object):
     """Represents a configuration object."""
@@ -42,18 +81,46 @@ class WebMonitorConfigObject(object):
             website status checks.
         """
         config_path = config_abs_path or os.path.join(WORK_DIR, 'config.json')
-        with open(config_path) as f:
-            configs = json.load(f)
+        with open(config_path, 'rb') as f:
+            data = f.read()
+        configs = orjson.loads(data) if orjson else json.loads(data)
         self.set_check_period_and_web_data(configs, check_period, defer_to_store)
 
     # check if website properties have at least defined the url
     # if they are properly formed, add them in the set of
     # self.websites
     def extract_websites(self, configs):
-        self.websites = copy.copy(configs)
-        for key, val in configs.items():
-            if 'url' not in val:
-                self.websites.pop(key,None)
+        self.websites = {key: val for key, val in configs.items()
+                         if isinstance(val, dict) and 'url' in val}
+        for web_data in self.websites.values():
+            web_data['_content_matcher'] = \
+                self.__class__.compile_content_requirements(
+                    web_data.get('content', None))
+
+    @staticmethod
+    def compile_content_requirements(content):
+        """
+        Prepare content requirements once so every check reuses them.
+        Plain ASCII text is kept as lowercased bytes, which can be searched
+        for in the raw response body without decoding it.
+
+        :param content: Content requirements regular expression
+        :return: Lowercased bytes for literal requirements, compiled pattern
+            otherwise, None if there are no requirements, or
+            INVALID_CONTENT_REQUIREMENTS if they cannot be compiled
+        """
+        if not content:
+            return None
+        try:
+            if not REGEX_SPECIAL_CHARS.intersection(content):
+                try:
+                    return content.lower().encode('ascii')
+                except UnicodeEncodeError:
+                    pass
+            return reg_ex.compile(content, reg_ex.IGNORECASE)
+        except (reg_ex.error, TypeError) as e:
+            log.error('Invalid content requirements %r: %s', content, e)
+            return INVALID_CONTENT_REQUIREMENTS
 
     @staticmethod
     def is_positive_int(i):
@@ -91,18 +158,22 @@ class WebMonitorConfigObject(object):
         try:
             val = int(val)
         except ValueError:
-            print('Please make sure that check period value is specified '
-                 'as integer.')
+            log.warning('Please make sure that check period value is '
+                        'specified as integer.')
             return False
         if val < 0:
-            print('Checking period cannot be negative. Please set correct '
-                 'value and try again.')
+            log.warning('Checking period cannot be negative. Please set '
+                        'correct value and try again.')
             return False
         self.__check_period = val
 
 class Monitor(object):
     """Represents Monitor object."""
     config_obj = None
+    # event loop and aiohttp session used by the watch thread; kept for the
+    # Monitor's lifetime so connections and DNS entries survive between rounds
+    _loop = None
+    _session = None
 
     def __init__(self, check_interval):
         """
@@ -126,22 +197,38 @@ class Monitor(object):
         for webname, web_data in self.config_store.websites.items():
             url = web_data['url']
             content_requirements = web_data.get('content', None)
-            print(f'{webname}, {url}, {content_requirements}')
+            log.debug('%s, %s, %s', webname, url, content_requirements)
             db_utils.insert_webcheck_config(webname, url, content_requirements)
 
     def start_watch(self):
         """
         Method responsible for triggering periodic checks in time intervals.
         If time interval is not specified it is set by default to 3600s(1h).
+        Checks run on a single long-lived thread.
 
         :return: None
         """
-        self.hot_load_config()
-        self._start_checks()
-        self.next_call += self.config_store.check_period
-        # accounts for drift
-        # more at https://stackoverflow.com/a/18180189/2808371
-        threading.Timer(self.next_call - time.time(), self.start_watch).start()
+        self.watch_thread = threading.Thread(target=self._watch_loop)
+        self.watch_thread.start()
+
+    def _watch_loop(self):
+        """
+        Method responsible for running rounds of checks until the process
+        exits.
+
+        :return: None
+        """
+        while True:
+            try:
+                self.hot_load_config()
+                self._start_checks()
+            except Exception:
+                # keep watching; the next round may succeed
+                log.exception('Round of checks failed')
+            self.next_call += self.config_store.check_period
+            # accounts for drift
+            # more at https://stackoverflow.com/a/18180189/2808371
+            time.sleep(max(0, self.next_call - time.time()))
 
     def _start_checks(self):
         """
@@ -149,47 +236,156 @@ class Monitor(object):
 
         :return: None
         """
-        # used for formatting first and last message of round of checks
-        time_format = '%d/%m/%Y %H:%M:%S'
-        asterix = '*' * 10
+        current_time = datetime.datetime.now().strftime(_TIME_FORMAT)
         s = ('\n{asterix}Starting new round of checks - {current_time}'
              '{asterix}')
-        log.info(s.format(asterix=asterix,
-                          current_time=datetime.datetime.now().strftime(
-                              time_format)))
+        log.info(s.format(asterix=_ASTERIX, current_time=current_time))
 
-        threads = []
+        webnames, urls, content_requirements, content_matchers = \
+            [], [], [], []
         for webname, web_data in self.config_store.websites.items():
-            url = web_data['url']
-            content_requirements = web_data.get('content', None)
-            t = threading.Thread(target=self._perform_checks, args=(
-                url, content_requirements, webname))
-            threads.append(t)
-            t.start()
-
-        for t in threads:
-            t.join()
+            webnames.append(webname)
+            urls.append(web_data['url'])
+            content_requirements.append(web_data.get('content', None))
+            content_matchers.append(web_data.get('_content_matcher', None))
+
+        records = []
+        if webnames and aiohttp:
+            if self._loop is None:
+                # asyncio.run() is not available on Python 3.6, and would
+                # close the loop (and the session bound to it) every round
+                self._loop = asyncio.new_event_loop()
+            results = self._loop.run_until_complete(self._async_start_checks(
+                urls, content_requirements, webnames, content_matchers))
+            records = [record for record in results if record is not None]
+        elif webnames:
+            workers = min(MAX_WORKERS, len(webnames))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(self._perform_checks, urls,
+                                       content_requirements, webnames,
+                                       content_matchers)
+                records = [record for record in results if record is not None]
+        db_utils.insert_webcheck_records_bulk(records)
         s = '\n{asterix}Finished all checks - {current_time}{asterix}'
-        log.info(s.format(asterix=asterix,
-                          current_time=datetime.datetime.now().strftime(
-                              time_format)))
+        log.info(s.format(asterix=_ASTERIX, current_time=current_time))
 
-    def _perform_checks(self, url, content_requirements, webname):
+    def _perform_checks(self, url, content_requirements, webname,
+                        content_matcher=None):
         """
         Method responsible for checking requirements on each website.
 
         :param url: URL of the page for which we want to check requirements
         :param content_requirements: Actual content requirements
+        :param webname: Alias name for website
+        :param content_matcher: Content requirements prepared with
+            WebMonitorConfigObject.compile_content_requirements
+        :return: Tuple representing status check record, or None
+        """
+        errors = []
+        need_body = content_requirements is not None
+        try:
+            response = self.make_request(url, webname, errors, need_body)
+            if response is None:
+                return errors[0] if errors else None
+            return self._evaluate_response(response, url,
+                                           content_requirements, webname,
+                                           content_matcher)
+        except Exception as e:
+            # a single broken website must not abort the whole round
+            log.exception('Unexpected error while checking %s', url)
+            return self._error_record(webname, url, e)
+
+    async def _async_start_checks(self, urls, content_requirements, webnames,
+                                  content_matchers):
+        """
+        Method responsible for checking all websites concurrently on one
+        thread with aiohttp.
+
+        :return: List of tuples representing status check records, or None
+        """
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=ASYNC_CONNECTION_LIMIT,
+                                             ttl_dns_cache=300)
+            # per-socket timeouts, so checks queued for a pooled connection
+            # are not counted against REQUEST_TIMEOUT
+            timeout = aiohttp.ClientTimeout(total=None,
+                                            sock_connect=REQUEST_TIMEOUT,
+                                            sock_read=REQUEST_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=timeout)
+        return await asyncio.gather(*[
+            self._async_perform_checks(self._session, *args)
+            for args in zip(urls, content_requirements, webnames,
+                            content_matchers)])
+
+    def close(self):
+        """
+        Method responsible for releasing the aiohttp session and its event
+        loop. Must be called from the thread that ran the checks.
+
         :return: None
         """
-        response = self.make_request(url, webname)
+        if self._session is not None:
+            self._loop.run_until_complete(self._session.close())
+            self._session = None
+        if self._loop is not None:
+            self._loop.close()
+            self._loop = None
+
+    async def _async_perform_checks(self, session, url, content_requirements,
+                                    webname, content_matcher=None):
+        """
+        Coroutine counterpart of _perform_checks using aiohttp session.
+
+        :param session: aiohttp.ClientSession instance
+        :return: Tuple representing status check record
+        """
+        need_body = content_requirements is not None
+        try:
+            response = await self._async_fetch(
+                session, 'GET' if need_body else 'HEAD', url)
+            if self._needs_get_fallback(response, need_body):
+                response = await self._async_fetch(session, 'GET', url)
+            self._log_response(url, response)
+            return self._evaluate_response(response, url,
+                                           content_requirements, webname,
+                                           content_matcher)
+        except Exception as e:
+            # a single broken website must not abort the whole round
+            if not isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+                log.exception('Unexpected error while checking %s', url)
+            return self._error_record(webname, url, e)
 
-        if not response:
-            return
+    @staticmethod
+    async def _async_fetch(session, method, url):
+        """
+        Static coroutine used to perform actual request to the server.
+
+        :param session: aiohttp.ClientSession instance
+        :param method: HTTP method, either 'GET' or 'HEAD'
+        :param url: URL of the page that we want to make request to
+        :return: AsyncResponse object
+        """
+        start = time.monotonic()
+        async with session.request(method, url, allow_redirects=True) as r:
+            # like requests' Response.elapsed, stop timing at the headers
+            elapsed = datetime.timedelta(seconds=time.monotonic() - start)
+            content = await r.read() if method == 'GET' else b''
+        return AsyncResponse(r.status, content, elapsed)
+
+    def _evaluate_response(self, response, url, content_requirements, webname,
+                           content_matcher=None):
+        """
+        Method responsible for checking requirements against a response.
+
+        :param response: requests.Response or AsyncResponse object
+        :return: Tuple representing status check record
+        """
         response_time = response.elapsed / datetime.timedelta(seconds=1)
         requirements_fulfilled = 1
         try:
-            self.check_requirements(response, content_requirements)
+            self.check_requirements(response,
+                                    content_matcher or content_requirements)
         except RequirementsNotFulfilled as e:
             s = ('Content requirements: {e} ("{content_requirements}" '
                  'not in response content)')
@@ -200,35 +396,83 @@ class Monitor(object):
                  '("{content_requirements}" in response content)')
             log.info(s.format(**locals()))
 
-        db_utils.insert_webcheck_record(webname, url, datetime.datetime.now(),
-                              response.status_code, response_time, requirements_fulfilled)
+        return (webname, url, datetime.datetime.now(), response.status_code,
+                response_time, requirements_fulfilled, None)
 
     @staticmethod
-    def make_request(url, webname=None):
+    def make_request(url, webname=None, records=None, need_body=True):
         """
         Static method used to perform actual request to the server.
 
         :param url: URL of the page that we want to make request to
         :param webname: Alias name for website
+        :param records: Optional list collecting error records; if not
+            given the error record is stored in the database right away
+        :param need_body: If False a HEAD request is made, so the response
+            body is not downloaded
         :return: If successful returns requests.Response object, otherwise None
         """
         try:
-            response = requests.get(url)
+            response = SESSION.request('GET' if need_body else 'HEAD', url,
+                                       timeout=REQUEST_TIMEOUT,
+                                       allow_redirects=True)
+            if Monitor._needs_get_fallback(response, need_body):
+                response = SESSION.get(url, timeout=REQUEST_TIMEOUT)
         except requests.exceptions.RequestException as e:
-            error_msg = str(e)
-            s = 'Connection problem\nError message: {}\n'
-            log.info(s.format(error_msg))
-            db_utils.insert_webcheck_record(
-                webname, url, request_time=datetime.datetime.now(),
-                error=error_msg)
+            record = Monitor._error_record(webname, url, e)
+            if records is None:
+                db_utils.insert_webcheck_records_bulk([record])
+            else:
+                records.append(record)
         else:
-            s = ('\nURL: {url}\nStatus: {response.status_code}\n'
-                 'Response time: {response.elapsed.seconds}s'
-                 '{response.elapsed.microseconds}\u00B5s')
-            log.info(s.format(**locals()))
+            Monitor._log_response(url, response)
             return response
         return None
 
+    @staticmethod
+    def _needs_get_fallback(response, need_body):
+        """
+        Static method used to decide if a HEAD request must be repeated
+        as GET because the server may not support HEAD. Only failing
+        HEAD responses are retried.
+
+        :param response: requests.Response or AsyncResponse object
+        :param need_body: Whether the response came from a GET request
+        :return: True if the request should be retried with GET
+        """
+        return (not need_body and
+                response.status_code >= HEAD_FALLBACK_MIN_STATUS)
+
+    @staticmethod
+    def _log_response(url, response):
+        """
+        Static method used to log status and timing of a response.
+
+        :param url: URL of the page that the request was made to
+        :param response: requests.Response or AsyncResponse object
+        :return: None
+        """
+        s = ('\nURL: {url}\nStatus: {response.status_code}\n'
+             'Response time: {response.elapsed.seconds}s'
+             '{response.elapsed.microseconds}\u00B5s')
+        log.info(s.format(**locals()))
+
+    @staticmethod
+    def _error_record(webname, url, error):
+        """
+        Static method used to log a failed request and build its record.
+
+        :param webname: Alias name for website
+        :param url: URL of the page that the request was made to
+        :param error: Exception raised while making the request
+        :return: Tuple representing status check record
+        """
+        error_msg = str(error) or error.__class__.__name__
+        s = 'Connection problem\nError message: {}\n'
+        log.info(s.format(error_msg))
+        return (webname, url, datetime.datetime.now(), None, None, None,
+                error_msg)
+
     @staticmethod
     def check_requirements(response, content_requirements):
         """
@@ -237,15 +481,28 @@ class Monitor(object):
 
         :param response: requests.Response object.
         :param content_requirements: Content requirements to check against
-            in response object.
+            in response object, either as a string or as prepared
+            by WebMonitorConfigObject.compile_content_requirements.
         :return: If requirements are met returns True, otherwise raises
             website_monitor.exceptions.RequirementsNotFulfilled
         """
-        response_content = response.content.decode('utf-8', 'ignore')
-        requirements_are_met = reg_ex.search(content_requirements,
-                                         response_content, reg_ex.IGNORECASE)
+        if isinstance(content_requirements, str):
+            content_requirements = \
+                WebMonitorConfigObject.compile_content_requirements(
+                    content_requirements)
+
+        if content_requirements is None:
+            requirements_are_met = True
+        elif content_requirements is INVALID_CONTENT_REQUIREMENTS:
+            requirements_are_met = False
+        elif isinstance(content_requirements, bytes):
+            requirements_are_met = \
+                content_requirements in response.content.lower()
+        else:
+            requirements_are_met = content_requirements.search(
+                response.content.decode('utf-8', 'ignore'))
 
-        if not content_requirements or requirements_are_met:
+        if requirements_are_met:
             # if there are no requirements or the requirements are fulfilled
             return True
         s = 'Website content does not match specified requirements.'